@@ -1,10 +1,15 @@
 """
 Example API Client for Marketing Automation Tool
 
-Demonstrates how to interact with the API programmatically
+Demonstrates how to interact with the API programmatically.
+AsyncMarketingAPIClient needs httpx (`pip install -r requirements.txt` installs it).
 """
 
+import asyncio
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import json
@@ -18,6 +23,15 @@ class MarketingAPIClient:
     def __init__(self, base_url: str = BASE_URL):
         self.base_url = base_url
         self.session = requests.Session()
+        
+        # Reuse keep-alive connections and retry transient gateway errors
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
     
     def upload_csv(self, csv_file_path: str) -> dict:
         """Upload marketing CSV file"""
@@ -96,6 +110,90 @@ class MarketingAPIClient:
         return response.json()
 
 
+class AsyncMarketingAPIClient:
+    """Async client sharing one connection pool so independent calls overlap (needs httpx)"""
+    
+    def __init__(self, base_url: str = BASE_URL):
+        # Imported here so the sync client above works without httpx installed
+        import httpx
+        
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=32),
+            timeout=30.0
+        )
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+    
+    async def upload_csv(self, csv_file_path: str) -> dict:
+        """Upload marketing CSV file"""
+        with open(csv_file_path, 'rb') as f:
+            files = {'file': f}
+            response = await self.client.post("/upload-csv", files=files)
+        return response.json()
+    
+    async def get_summary(self) -> dict:
+        """Get high-level summary of all data"""
+        response = await self.client.get("/summary")
+        return response.json()
+    
+    async def get_metrics(
+        self,
+        date_from: str = None,
+        date_to: str = None,
+        campaign: str = None
+    ) -> dict:
+        """Get metrics with optional filtering"""
+        params = {}
+        if date_from:
+            params['date_from'] = date_from
+        if date_to:
+            params['date_to'] = date_to
+        if campaign:
+            params['campaign'] = campaign
+        
+        response = await self.client.get("/metrics", params=params)
+        return response.json()
+    
+    async def get_campaigns(self) -> dict:
+        """Get all unique campaigns"""
+        response = await self.client.get("/campaigns")
+        return response.json()
+    
+    async def get_daily_performance(self) -> dict:
+        """Get daily aggregated performance"""
+        response = await self.client.get("/daily-performance")
+        return response.json()
+    
+    async def get_top_campaigns(
+        self,
+        limit: int = 5,
+        metric: str = "spend"
+    ) -> dict:
+        """Get top campaigns by specified metric"""
+        params = {
+            'limit': limit,
+            'metric': metric
+        }
+        response = await self.client.get("/top-campaigns", params=params)
+        return response.json()
+    
+    async def get_upload_logs(self, limit: int = 10) -> dict:
+        """Get recent upload logs"""
+        params = {'limit': limit}
+        response = await self.client.get("/upload-logs", params=params)
+        return response.json()
+    
+    async def health_check(self) -> dict:
+        """Check API health"""
+        response = await self.client.get("/health")
+        return response.json()
+
+
 def print_section(title: str):
     """Print formatted section header"""
     print(f"\n{'='*60}")
@@ -103,38 +201,48 @@ def print_section(title: str):
     print(f"{'='*60}")
 
 
-def example_usage():
+async def example_usage():
     """Example usage of the API client"""
     
-    # Initialize client
-    client = MarketingAPIClient()
-    
-    # Health check
-    print_section("1. Health Check")
-    health = client.health_check()
-    print(json.dumps(health, indent=2))
-    
-    # Upload sample data
-    print_section("2. Upload CSV Data")
-    try:
-        upload_result = client.upload_csv("data/sample_marketing.csv")
-        print(json.dumps(upload_result, indent=2))
-    except FileNotFoundError:
-        print("Sample CSV not found. Skipping upload.")
+    async with AsyncMarketingAPIClient() as client:
+        # Health check
+        print_section("1. Health Check")
+        health = await client.health_check()
+        print(json.dumps(health, indent=2))
+        
+        # Upload sample data
+        print_section("2. Upload CSV Data")
+        try:
+            upload_result = await client.upload_csv("data/sample_marketing.csv")
+            print(json.dumps(upload_result, indent=2))
+        except FileNotFoundError:
+            print("Sample CSV not found. Skipping upload.")
+        
+        # The remaining reads are independent, so fetch them concurrently
+        (
+            summary, campaigns, top_campaigns, top_roi,
+            daily, metrics, campaign_metrics, logs
+        ) = await asyncio.gather(
+            client.get_summary(),
+            client.get_campaigns(),
+            client.get_top_campaigns(limit=3, metric="spend"),
+            client.get_top_campaigns(limit=3, metric="roi"),
+            client.get_daily_performance(),
+            client.get_metrics(date_from="2026-01-01", date_to="2026-01-07"),
+            client.get_metrics(campaign="google"),
+            client.get_upload_logs(limit=5)
+        )
     
     # Get summary
     print_section("3. Get Summary Statistics")
-    summary = client.get_summary()
     print(json.dumps(summary, indent=2))
     
     # Get campaigns
     print_section("4. Get All Campaigns")
-    campaigns = client.get_campaigns()
     print(json.dumps(campaigns, indent=2))
     
     # Get top campaigns
     print_section("5. Top Campaigns by Spend")
-    top_campaigns = client.get_top_campaigns(limit=3, metric="spend")
     if top_campaigns['count'] > 0:
         for campaign in top_campaigns['data']:
             print(f"\n  Campaign: {campaign['campaign_name']}")
@@ -147,7 +255,6 @@ def example_usage():
     
     # Get top campaigns by ROI
     print_section("6. Top Campaigns by ROI")
-    top_roi = client.get_top_campaigns(limit=3, metric="roi")
     if top_roi['count'] > 0:
         for campaign in top_roi['data']:
             print(f"\n  Campaign: {campaign['campaign_name']}")
@@ -158,7 +265,6 @@ def example_usage():
     
     # Get daily performance
     print_section("7. Daily Performance (Last 5 Days)")
-    daily = client.get_daily_performance()
     if daily['count'] > 0:
         for day in daily['data'][-5:]:  # Last 5 days
             print(f"\n  Date: {day['date']}")
@@ -171,24 +277,18 @@ def example_usage():
     
     # Get metrics for specific date range
     print_section("8. Metrics for Date Range")
-    metrics = client.get_metrics(
-        date_from="2026-01-01",
-        date_to="2026-01-07"
-    )
     print(f"  Records found: {metrics['count']}")
     if metrics['count'] > 0:
         print(f"  First record: {metrics['data'][0]}")
     
     # Get metrics for specific campaign
     print_section("9. Metrics for Specific Campaign")
-    campaign_metrics = client.get_metrics(campaign="google")
     print(f"  Campaign metrics found: {campaign_metrics['count']}")
     if campaign_metrics['count'] > 0:
         print(f"  Sample: {campaign_metrics['data'][0]}")
     
     # Get upload logs
     print_section("10. Recent Upload Logs")
-    logs = client.get_upload_logs(limit=5)
     for log in logs['data']:
         print(f"\n  File: {log['filename']}")
         print(f"  Status: {log['status']}")
@@ -200,16 +300,16 @@ def example_usage():
 
 def create_sample_data():
     """Create additional sample data for testing"""
-    data = {
-        'date': pd.date_range('2026-01-01', periods=30).strftime('%Y-%m-%d'),
-        'campaign_name': ['Google Search'] * 10 + ['Meta Ads'] * 10 + ['LinkedIn'] * 10,
-        'impressions': [5000 + i*100 for i in range(30)],
-        'clicks': [150 + i*3 for i in range(30)],
-        'spend': [500 + i*10 for i in range(30)],
-        'revenue': [2500 + i*50 for i in range(30)]
-    }
-    
-    df = pd.DataFrame(data)
+    n = 30
+    idx = np.arange(n)
+    df = pd.DataFrame({
+        'date': pd.date_range('2026-01-01', periods=n),
+        'campaign_name': np.repeat(['Google Search', 'Meta Ads', 'LinkedIn'], n // 3),
+        'impressions': 5000 + 100 * idx,
+        'clicks': 150 + 3 * idx,
+        'spend': 500 + 10 * idx,
+        'revenue': 2500 + 50 * idx
+    })
     df.to_csv('data/extended_marketing.csv', index=False)
     print("✓ Created extended_marketing.csv")
 
@@ -219,7 +319,7 @@ if __name__ == "__main__":
     print(f"API Base URL: {BASE_URL}")
     
     # Run examples
-    example_usage()
+    asyncio.run(example_usage())
     
     # Optional: Create extended sample data
     print("\n\nWould you like to create extended sample data? (uncomment line below)")
@@ -1,29 +1,108 @@
+import os
 import pandas as pd
 import numpy as np
 from datetime import datetime
 from typing import List, Tuple
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 from app.models import RawMarketingData, ProcessedMetrics, UploadLog
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; calculate_metrics falls back to numpy
+    njit = None
+
+try:
+    import numexpr as ne
+except ImportError:  # numexpr is optional; calculate_metrics falls back to numpy
+    ne = None
+
+# Values of POLARS_ETL that opt in to the polars path
+_TRUTHY = frozenset({"1", "true", "yes", "on"})
+
+
+def _load_polars():
+    """Import polars on first use if POLARS_ETL opts in and it is installed, else None"""
+    if os.getenv("POLARS_ETL", "").strip().lower() not in _TRUTHY:
+        return None
+    try:
+        import polars
+    except ImportError:  # polars is optional; calculate_metrics falls back to numpy
+        return None
+    return polars
+
+
+def _metrics_kernel(impressions, clicks, spend, revenue, ctr, cpc, roi):
+    """Fill ctr/cpc/roi in one pass over the inputs (JIT-compiled when numba is installed)"""
+    for i in range(impressions.shape[0]):
+        ctr[i] = np.round(clicks[i] / impressions[i] * 100, 2) if impressions[i] > 0 else 0.0
+        cpc[i] = np.round(spend[i] / clicks[i], 2) if clicks[i] > 0 else 0.0
+        roi[i] = np.round((revenue[i] - spend[i]) / spend[i] * 100, 2) if spend[i] > 0 else 0.0
+
+
+if njit is not None:
+    _metrics_kernel = njit(cache=True)(_metrics_kernel)
+
 
 class MarketingETL:
     """ETL pipeline for marketing data"""
     
-    REQUIRED_COLUMNS = {"date", "campaign_name", "impressions", "clicks", "spend"}
+    REQUIRED_COLUMNS = frozenset({"date", "campaign_name", "impressions", "clicks", "spend"})
+    NUMERIC_COLUMNS = ["impressions", "clicks", "spend"]
+    RAW_COLUMNS = ["campaign_name", "date", "impressions", "clicks", "spend", "revenue"]
+    METRIC_COLUMNS = RAW_COLUMNS + ["ctr", "cpc", "roi"]
+    CLEAN_DTYPES = {
+        "impressions": np.dtype(np.int64),
+        "clicks": np.dtype(np.int64),
+        "spend": np.dtype(np.float64),
+        "revenue": np.dtype(np.float64)
+    }
+    # Below this many rows the numpy path is cheaper than a first-call JIT compile
+    JIT_MIN_ROWS = 10_000
+    # numexpr's thread/block setup only pays off on large inputs (used when numba is absent)
+    NUMEXPR_MIN_ROWS = 100_000
+    CSV_DTYPES = {
+        "campaign_name": "string",
+        "impressions": "int64",
+        "clicks": "int64",
+        "spend": "float64",
+        "revenue": "float64"
+    }
+    
+    @staticmethod
+    def read_csv(file_path: str) -> pd.DataFrame:
+        """Read CSV with typed parsing, falling back to inference for malformed files"""
+        columns = MarketingETL.REQUIRED_COLUMNS | {"revenue"}
+        try:
+            return pd.read_csv(
+                file_path,
+                usecols=lambda col: col in columns,
+                dtype=MarketingETL.CSV_DTYPES,
+                parse_dates=["date"],
+                engine="c"
+            )
+        except (ValueError, TypeError):
+            # Missing columns or unparseable values: let validate_csv report them
+            return pd.read_csv(file_path)
     
     @staticmethod
     def validate_csv(df: pd.DataFrame) -> Tuple[bool, str]:
         """Validate CSV has required columns and data types"""
+        # Check for missing or empty dataframe (cheapest check first)
+        if df is None or df.empty:
+            return False, "CSV file is empty"
+        
         # Check required columns
-        missing_cols = MarketingETL.REQUIRED_COLUMNS - set(df.columns)
+        missing_cols = MarketingETL.REQUIRED_COLUMNS.difference(df.columns)
         if missing_cols:
-            return False, f"Missing columns: {missing_cols}"
+            return False, f"Missing columns: {set(missing_cols)}"
         
-        # Check for empty dataframe
-        if df.empty:
-            return False, "CSV file is empty"
+        # Blank names would otherwise reach the DB as the strings "nan" / "<NA>" / ""
+        names = df['campaign_name']
+        if names.isna().any() or (pd.Index(names.unique()).astype(str).str.strip() == "").any():
+            return False, "Campaign name cannot be empty"
         
-        # Check data types
+        # Check data types (coerced in place so clean_data can reuse them)
         try:
             df['date'] = pd.to_datetime(df['date'])
             df['impressions'] = pd.to_numeric(df['impressions'])
@@ -33,104 +112,152 @@ class MarketingETL:
         except Exception as e:
             return False, f"Data type conversion error: {str(e)}"
         
-        # Business logic validation
-        if (df['clicks'] > df['impressions']).any():
-            return False, "Clicks cannot exceed impressions"
-        
-        if (df['spend'] < 0).any() or (df['impressions'] < 0).any():
+        # Business logic validation: one reduction over the numeric block, one fused compare
+        if (df[MarketingETL.NUMERIC_COLUMNS].to_numpy() < 0).any():
             return False, "Negative values not allowed"
         
+        if (df['clicks'].to_numpy() > df['impressions'].to_numpy()).any():
+            return False, "Clicks cannot exceed impressions"
+        
         return True, "Validation passed"
     
     @staticmethod
     def clean_data(df: pd.DataFrame) -> pd.DataFrame:
         """Clean and standardize data"""
-        # Remove duplicates
-        df = df.drop_duplicates()
+        # Remove duplicates (shallow copy marks the result as its own frame, not a slice)
+        df = df.drop_duplicates().copy(deep=False)
         
-        # Handle missing values
-        df['revenue'] = df.get('revenue', 0).fillna(0)
-        df['clicks'] = df['clicks'].fillna(0).astype(int)
-        df['impressions'] = df['impressions'].fillna(0).astype(int)
-        df['spend'] = df['spend'].fillna(0).astype(float)
+        # Handle missing values (revenue is optional and defaults to 0)
+        if 'revenue' not in df:
+            df['revenue'] = 0.0
+        for col, dtype in MarketingETL.CLEAN_DTYPES.items():
+            # Typed reads usually match already; only copy columns that need work
+            if df[col].dtype != dtype or df[col].hasnans:
+                df[col] = df[col].fillna(0).astype(dtype)
         
-        # Standardize date format
-        df['date'] = pd.to_datetime(df['date']).dt.date
+        # Standardize date format (already parsed when validate_csv ran first)
+        if not pd.api.types.is_datetime64_any_dtype(df['date']):
+            df['date'] = pd.to_datetime(df['date'])
+        df['date'] = df['date'].dt.date
         
-        # Standardize campaign names
-        df['campaign_name'] = df['campaign_name'].str.strip().str.lower()
+        # Standardize campaign names: clean each distinct name once, then map back by code
+        codes, names = pd.factorize(df['campaign_name'])
+        names = pd.Index(names).str.strip().str.lower()
+        df['campaign_name'] = names.take(codes, allow_fill=True, fill_value=np.nan).array
         
         return df
     
     @staticmethod
     def calculate_metrics(df: pd.DataFrame) -> pd.DataFrame:
         """Calculate CTR, CPC, ROI"""
-        df = df.copy()
-        
-        # CTR = clicks / impressions (avoid division by zero)
-        df['ctr'] = np.where(
-            df['impressions'] > 0,
-            (df['clicks'] / df['impressions'] * 100).round(2),
-            0
-        )
-        
-        # CPC = spend / clicks (avoid division by zero)
-        df['cpc'] = np.where(
-            df['clicks'] > 0,
-            (df['spend'] / df['clicks']).round(2),
-            0
-        )
-        
-        # ROI = (revenue - spend) / spend * 100 (avoid division by zero)
-        df['roi'] = np.where(
-            df['spend'] > 0,
-            ((df['revenue'] - df['spend']) / df['spend'] * 100).round(2),
-            0
-        )
+        impressions = df['impressions'].to_numpy(dtype=np.float64)
+        clicks = df['clicks'].to_numpy(dtype=np.float64)
+        spend = df['spend'].to_numpy(dtype=np.float64)
+        revenue = df['revenue'].to_numpy(dtype=np.float64)
         
-        return df
+        # Opt-in polars path: same formulas, divisions run multi-threaded in Rust
+        pl = _load_polars()
+        if pl is not None:
+            ratios = pl.DataFrame({
+                "impressions": impressions,
+                "clicks": clicks,
+                "spend": spend,
+                "revenue": revenue
+            }).select(
+                ctr=pl.when(pl.col("impressions") > 0)
+                .then(pl.col("clicks") / pl.col("impressions") * 100).otherwise(0.0),
+                cpc=pl.when(pl.col("clicks") > 0)
+                .then(pl.col("spend") / pl.col("clicks")).otherwise(0.0),
+                roi=pl.when(pl.col("spend") > 0)
+                .then((pl.col("revenue") - pl.col("spend")) / pl.col("spend") * 100).otherwise(0.0)
+            ).to_numpy()
+            # numpy rounding keeps results bit-identical to the default path
+            ctr, cpc, roi = np.round(ratios, 2).T
+            return df.assign(ctr=ctr, cpc=cpc, roi=roi)
+        
+        # Large frames: one fused JIT loop instead of three numpy passes
+        if njit is not None and len(df) >= MarketingETL.JIT_MIN_ROWS:
+            ctr, cpc, roi = np.empty(len(df)), np.empty(len(df)), np.empty(len(df))
+            _metrics_kernel(impressions, clicks, spend, revenue, ctr, cpc, roi)
+            return df.assign(ctr=ctr, cpc=cpc, roi=roi)
+        
+        # One (3, n) buffer so the final rounding is a single vectorized pass
+        out = np.zeros((3, len(df)))
+        ctr, cpc, roi = out
+        
+        if ne is not None and len(df) >= MarketingETL.NUMEXPR_MIN_ROWS:
+            # Fused, blocked evaluation: each expression streams its inputs once
+            arrays = {"impressions": impressions, "clicks": clicks, "spend": spend, "revenue": revenue}
+            ne.evaluate("where(impressions > 0, clicks / impressions * 100, 0.0)",
+                        local_dict=arrays, out=ctr)
+            ne.evaluate("where(clicks > 0, spend / clicks, 0.0)", local_dict=arrays, out=cpc)
+            ne.evaluate("where(spend > 0, (revenue - spend) / spend * 100, 0.0)",
+                        local_dict=arrays, out=roi)
+        else:
+            # CTR = clicks / impressions (division skipped where impressions is zero)
+            np.divide(clicks, impressions, out=ctr, where=impressions > 0)
+            ctr *= 100
+            
+            # CPC = spend / clicks (division skipped where clicks is zero)
+            np.divide(spend, clicks, out=cpc, where=clicks > 0)
+            
+            # ROI = (revenue - spend) / spend * 100 (division skipped where spend is zero)
+            np.divide(revenue - spend, spend, out=roi, where=spend > 0)
+            roi *= 100
+        
+        np.round(out, 2, out=out)
+        
+        # assign() returns a new frame, leaving the caller's df untouched
+        return df.assign(ctr=ctr, cpc=cpc, roi=roi)
     
     @staticmethod
-    def load_to_database(df: pd.DataFrame, db: Session, filename: str) -> Tuple[int, str]:
-        """Load processed data to database"""
+    def load_to_database(df: pd.DataFrame, db: Session, filename: str) -> Tuple[int, int, str]:
+        """Load processed data to database, returning (inserted, skipped, status)"""
         try:
-            # Store raw data
-            for _, row in df.iterrows():
-                raw_record = RawMarketingData(
-                    campaign_name=row['campaign_name'],
-                    date=row['date'],
-                    impressions=int(row['impressions']),
-                    clicks=int(row['clicks']),
-                    spend=float(row['spend']),
-                    revenue=float(row['revenue'])
-                )
-                db.add(raw_record)
+            # Coerce dtypes once so the mappings carry plain Python ints/floats
+            df = df.astype({
+                "impressions": "int64",
+                "clicks": "int64",
+                "spend": "float64",
+                "revenue": "float64",
+                "ctr": "float64",
+                "cpc": "float64",
+                "roi": "float64"
+            })
             
-            # Store processed metrics
-            for _, row in df.iterrows():
-                metric_record = ProcessedMetrics(
-                    campaign_name=row['campaign_name'],
-                    date=row['date'],
-                    impressions=int(row['impressions']),
-                    clicks=int(row['clicks']),
-                    spend=float(row['spend']),
-                    revenue=float(row['revenue']),
-                    ctr=float(row['ctr']),
-                    cpc=float(row['cpc']),
-                    roi=float(row['roi'])
-                )
-                db.add(metric_record)
+            # Build insert mappings once instead of materializing ORM objects per row
+            raw_rows = df[MarketingETL.RAW_COLUMNS].to_dict("records")
+            metric_rows = df[MarketingETL.METRIC_COLUMNS].to_dict("records")
+            
+            # Store raw data, processed metrics and the upload log in one transaction;
+            # commit() rather than begin() so a session that already autobegan still works
+            db.bulk_insert_mappings(RawMarketingData, raw_rows)
+            # Rows whose (campaign_name, date) is already stored, or repeated within
+            # this file, are skipped; run on the connection so rowcount is available
+            result = db.connection().execute(
+                sqlite_insert(ProcessedMetrics.__table__).on_conflict_do_nothing(
+                    index_elements=["campaign_name", "date"]
+                ),
+                metric_rows
+            )
+            inserted = result.rowcount
+            skipped = len(metric_rows) - inserted
+            status = "success" if skipped == 0 else "partial"
             
             # Log upload
             upload_log = UploadLog(
                 filename=filename,
-                rows_uploaded=len(df),
-                status="success"
+                rows_uploaded=inserted,
+                status=status,
+                error_message=(
+                    f"Skipped {skipped} rows with an existing campaign and date"
+                    if skipped else None
+                )
             )
             db.add(upload_log)
             db.commit()
             
-            return len(df), "success"
+            return inserted, skipped, status
         
         except Exception as e:
             db.rollback()
@@ -142,14 +269,14 @@ class MarketingETL:
             )
             db.add(upload_log)
             db.commit()
-            return 0, f"Database error: {str(e)}"
+            return 0, 0, f"Database error: {str(e)}"
     
     @staticmethod
-    def process_csv(file_path: str, db: Session, filename: str) -> Tuple[bool, str, int]:
-        """Full ETL pipeline"""
+    def process_csv(file_path: str, db: Session, filename: str) -> Tuple[bool, str, int, int]:
+        """Full ETL pipeline, returning (success, message, rows_loaded, rows_skipped)"""
         try:
             # Read CSV
-            df = pd.read_csv(file_path)
+            df = MarketingETL.read_csv(file_path)
             
             # Validate
             is_valid, validation_msg = MarketingETL.validate_csv(df)
@@ -162,7 +289,7 @@ class MarketingETL:
                 )
                 db.add(log)
                 db.commit()
-                return False, validation_msg, 0
+                return False, validation_msg, 0, 0
             
             # Clean
             df = MarketingETL.clean_data(df)
@@ -171,9 +298,10 @@ class MarketingETL:
             df = MarketingETL.calculate_metrics(df)
             
             # Load
-            rows_loaded, status_msg = MarketingETL.load_to_database(df, db, filename)
+            rows_loaded, rows_skipped, status_msg = MarketingETL.load_to_database(df, db, filename)
             
-            return True, status_msg, rows_loaded
+            # load_to_database reports its own failures through the status message
+            return status_msg in ("success", "partial"), status_msg, rows_loaded, rows_skipped
         
         except Exception as e:
             log = UploadLog(
@@ -184,4 +312,4 @@ class MarketingETL:
             )
             db.add(log)
             db.commit()
-            return False, str(e), 0
+            return False, str(e), 0, 0
@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from app.models import init_db
 from app.routes import router
@@ -12,7 +13,8 @@ init_db()
 app = FastAPI(
     title="Marketing Automation Tool",
     description="Internal tool for automating marketing data processing and reporting",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -36,6 +38,7 @@ async def root():
         "endpoints": {
             "upload": "POST /upload-csv",
             "metrics": "GET /metrics",
+            "metrics_export": "GET /metrics/export",
             "summary": "GET /summary",
             "campaigns": "GET /campaigns",
             "daily_performance": "GET /daily-performance",
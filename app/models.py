@@ -1,9 +1,14 @@
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, create_engine
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, create_engine, event, Index, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
+import argparse
+import logging
+import os
 
 Base = declarative_base()
+logger = logging.getLogger(__name__)
 
 class RawMarketingData(Base):
     """Raw uploaded CSV data"""
@@ -22,10 +27,17 @@ class RawMarketingData(Base):
 class ProcessedMetrics(Base):
     """Calculated metrics from raw data"""
     __tablename__ = "processed_metrics"
+    __table_args__ = (
+        # Composite indexes for date-range filters and per-date/per-campaign rollups;
+        # (campaign_name, date) is the natural key, so re-uploads can't duplicate rows
+        Index("ix_pm_date_campaign", "date", "campaign_name"),
+        Index("uq_pm_campaign_date", "campaign_name", "date", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    campaign_name = Column(String, index=True)
-    date = Column(Date, index=True)
+    # Covered by the composite indexes above, which lead with each of these columns
+    campaign_name = Column(String)
+    date = Column(Date)
     impressions = Column(Integer)
     clicks = Column(Integer)
     spend = Column(Float)
@@ -48,13 +60,33 @@ class UploadLog(Base):
     error_message = Column(String, nullable=True)
 
 
-# Database configuration
-DATABASE_URL = "sqlite:///./marketing_data.db"
+# Database configuration (WAL keeps recent commits in -wal/-shm files next to the database,
+# so containers must mount its directory rather than the single file)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./marketing_data.db")
 
 engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
+    DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    query_cache_size=1200,
+    poolclass=QueuePool,
+    pool_size=10,
+    max_overflow=20
 )
 
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _):
+    """Tune SQLite per connection: WAL lets reads run alongside uploads"""
+    cursor = dbapi_conn.cursor()
+    cursor.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA temp_store=MEMORY;"
+        "PRAGMA cache_size=-64000;"
+        "PRAGMA mmap_size=268435456;"
+    )
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -67,6 +99,61 @@ def get_db():
         db.close()
 
 
+_DUPLICATE_METRICS_WHERE = (
+    "WHERE id NOT IN (SELECT MIN(id) FROM processed_metrics GROUP BY campaign_name, date)"
+)
+
+
+# Earlier processed_metrics indexes now covered by uq_pm_campaign_date / ix_pm_date_campaign,
+# which lead with the same columns
+_SUPERSEDED_INDEXES = (
+    "ix_pm_campaign_date",
+    "ix_processed_metrics_campaign_name",
+    "ix_processed_metrics_date",
+)
+
+
+def dedupe_processed_metrics() -> int:
+    """Delete all but the first processed_metrics row per (campaign_name, date)"""
+    with engine.begin() as conn:
+        removed = conn.execute(text(f"DELETE FROM processed_metrics {_DUPLICATE_METRICS_WHERE}")).rowcount
+    logger.warning("Removed %d duplicate processed_metrics rows", removed)
+    return removed
+
+
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
+    
+    # create_all skips existing tables, so add indexes introduced after first run
+    existing = {ix["name"] for ix in inspect(engine).get_indexes(ProcessedMetrics.__tablename__)}
+    with engine.begin() as conn:
+        if "uq_pm_campaign_date" not in existing:
+            duplicates = conn.execute(
+                text(f"SELECT COUNT(*) FROM processed_metrics {_DUPLICATE_METRICS_WHERE}")
+            ).scalar()
+            if duplicates:
+                raise RuntimeError(
+                    f"processed_metrics has {duplicates} rows repeating a (campaign_name, date) "
+                    "pair, so the unique index uq_pm_campaign_date cannot be created. Back up "
+                    "the database, then run `python -m app.models --dedupe` to keep the first "
+                    "row per pair (or remove the duplicates yourself) and restart."
+                )
+        for name in _SUPERSEDED_INDEXES:
+            if name in existing:
+                conn.execute(text(f"DROP INDEX {name}"))
+        for index in ProcessedMetrics.__table__.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="delete duplicate processed_metrics rows, keeping the first per campaign and date"
+    )
+    if parser.parse_args().dedupe:
+        logging.basicConfig(level=logging.INFO)
+        dedupe_processed_metrics()
+    init_db()
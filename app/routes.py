@@ -1,15 +1,88 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from cachetools import TTLCache, cached
+from cachetools.keys import hashkey
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 from datetime import date
 from typing import List, Optional
 import tempfile
+import threading
+import shutil
 import os
+import uuid
+import orjson
 from app.models import get_db, ProcessedMetrics, UploadLog, RawMarketingData
 from app.etl import MarketingETL
 
 router = APIRouter()
 
+UPLOAD_CHUNK_SIZE = 1 << 20
+EXPORT_BATCH_SIZE = 1000
+
+# Shared statement base; filters are bound parameters so the compiled SQL is reused
+_METRICS_SELECT = select(ProcessedMetrics)
+
+# Read endpoint results, cleared whenever an upload changes the data
+_CACHE = TTLCache(maxsize=256, ttl=60)
+_CACHE_LOCK = threading.Lock()
+
+# Campaign names only change on upload, so keep them until the next one
+_campaigns_cache: Optional[List[str]] = None
+
+# Bumped on every successful upload; with the boot id it forms the read endpoints' ETag
+_DATA_VERSION = 0
+_BOOT_ID = uuid.uuid4().hex[:8]
+CACHE_CONTROL = "public, max-age=30"
+
+
+def _filter_metrics(query, date_from: Optional[str], date_to: Optional[str], campaign: Optional[str]):
+    """Apply the shared /metrics filters to a query or select statement"""
+    if date_from:
+        query = query.filter(ProcessedMetrics.date >= date_from)
+    if date_to:
+        query = query.filter(ProcessedMetrics.date <= date_to)
+    if campaign:
+        query = query.filter(ProcessedMetrics.campaign_name.ilike(f"%{campaign}%"))
+    return query
+
+
+def _metric_to_dict(m: ProcessedMetrics) -> dict:
+    """Serialize a ProcessedMetrics row for API responses"""
+    return {
+        "date": m.date.isoformat(),
+        "campaign_name": m.campaign_name,
+        "impressions": m.impressions,
+        "clicks": m.clicks,
+        "spend": m.spend,
+        "revenue": m.revenue,
+        "ctr": m.ctr,
+        "cpc": m.cpc,
+        "roi": m.roi
+    }
+
+
+def _check_etag(request: Request, response: Response):
+    """Answer conditional GETs with 304 until an upload changes the data (call after validation)"""
+    etag = f'W/"{_BOOT_ID}-{_DATA_VERSION}"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        raise HTTPException(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
+
+
+def _cache_key(endpoint: str):
+    """Build a cache key function from the endpoint name, data version and query params"""
+    def key(db: Session = None, **params):
+        # cached() stores the result outside the lock; keying on the version read before the
+        # query means a result computed across an upload lands under a key no one asks for
+        return hashkey(endpoint, _DATA_VERSION, **params)
+    return key
+
 
 @router.post("/upload-csv")
 async def upload_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
@@ -19,29 +92,35 @@ async def upload_csv(file: UploadFile = File(...), db: Session = Depends(get_db)
     Expected columns: date, campaign_name, impressions, clicks, spend
     Optional: revenue (defaults to 0 if missing)
     """
+    global _campaigns_cache, _DATA_VERSION
+    
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="File must be CSV format")
     
     try:
-        # Save uploaded file temporarily
+        # Stream uploaded file to a temp file in 1MB chunks, off the event loop
         with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp:
-            content = await file.read()
-            tmp.write(content)
+            await run_in_threadpool(shutil.copyfileobj, file.file, tmp, UPLOAD_CHUNK_SIZE)
             tmp_path = tmp.name
         
-        # Process CSV through ETL
-        success, message, rows_loaded = MarketingETL.process_csv(
-            tmp_path, db, file.filename
+        # Process CSV through ETL off the event loop
+        success, message, rows_loaded, rows_skipped = await run_in_threadpool(
+            MarketingETL.process_csv, tmp_path, db, file.filename
         )
         
         # Clean up temp file
         os.unlink(tmp_path)
         
         if success:
+            with _CACHE_LOCK:
+                _CACHE.clear()
+                _campaigns_cache = None
+                _DATA_VERSION += 1
             return {
                 "status": "success",
                 "message": message,
                 "rows_loaded": rows_loaded,
+                "rows_skipped": rows_skipped,
                 "filename": file.filename
             }
         else:
@@ -52,10 +131,12 @@ async def upload_csv(file: UploadFile = File(...), db: Session = Depends(get_db)
 
 
 @router.get("/metrics")
-async def get_metrics(
+def get_metrics(
     date_from: Optional[str] = Query(None),
     date_to: Optional[str] = Query(None),
     campaign: Optional[str] = Query(None),
+    limit: int = Query(500, ge=1, le=5000),
+    offset: int = Query(0, ge=0),
     db: Session = Depends(get_db)
 ):
     """
@@ -65,133 +146,154 @@ async def get_metrics(
     - date_from: YYYY-MM-DD
     - date_to: YYYY-MM-DD
     - campaign: campaign name (partial match)
+    - limit: page size (max 5000)
+    - offset: rows to skip
     """
-    query = db.query(ProcessedMetrics)
-    
-    if date_from:
-        query = query.filter(ProcessedMetrics.date >= date_from)
-    if date_to:
-        query = query.filter(ProcessedMetrics.date <= date_to)
-    if campaign:
-        query = query.filter(ProcessedMetrics.campaign_name.ilike(f"%{campaign}%"))
-    
-    metrics = query.order_by(ProcessedMetrics.date.desc()).all()
+    stmt = _filter_metrics(_METRICS_SELECT, date_from, date_to, campaign)
+    stmt = stmt.order_by(ProcessedMetrics.date.desc()).limit(limit).offset(offset)
+    metrics = db.execute(stmt).scalars().all()
     
     if not metrics:
         return {"data": [], "count": 0}
     
     return {
-        "data": [
-            {
-                "date": str(m.date),
-                "campaign_name": m.campaign_name,
-                "impressions": m.impressions,
-                "clicks": m.clicks,
-                "spend": m.spend,
-                "revenue": m.revenue,
-                "ctr": m.ctr,
-                "cpc": m.cpc,
-                "roi": m.roi
-            }
-            for m in metrics
-        ],
+        "data": [_metric_to_dict(m) for m in metrics],
         "count": len(metrics)
     }
 
 
-@router.get("/summary")
-async def get_summary(db: Session = Depends(get_db)):
-    """Get high-level summary of all marketing data"""
-    metrics = db.query(ProcessedMetrics).all()
+@router.get("/metrics/export")
+def export_metrics(
+    date_from: Optional[str] = Query(None),
+    date_to: Optional[str] = Query(None),
+    campaign: Optional[str] = Query(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Stream all matching metrics as JSON lines (one record per line)
     
-    if not metrics:
-        return {
-            "total_spend": 0,
-            "total_revenue": 0,
-            "total_impressions": 0,
-            "total_clicks": 0,
-            "avg_ctr": 0,
-            "avg_cpc": 0,
-            "avg_roi": 0,
-            "num_campaigns": 0,
-            "total_records": 0
-        }
+    Accepts the same filters as /metrics but no pagination; rows are
+    fetched from the database in batches so memory stays bounded.
+    """
+    stmt = _filter_metrics(_METRICS_SELECT, date_from, date_to, campaign)
+    stmt = stmt.order_by(ProcessedMetrics.date.desc()).execution_options(yield_per=EXPORT_BATCH_SIZE)
     
-    total_spend = sum(m.spend for m in metrics)
-    total_revenue = sum(m.revenue for m in metrics)
-    total_impressions = sum(m.impressions for m in metrics)
-    total_clicks = sum(m.clicks for m in metrics)
+    def generate():
+        for m in db.execute(stmt).scalars():
+            yield orjson.dumps(_metric_to_dict(m)) + b"\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@router.get("/summary")
+def get_summary(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Get high-level summary of all marketing data"""
+    _check_etag(request, response)
+    return _summary(db)
+
+
+@cached(_CACHE, key=_cache_key("summary"), lock=_CACHE_LOCK)
+def _summary(db: Session):
+    """Aggregate the summary totals (cached until the next upload)"""
+    (
+        total_spend, total_revenue, total_impressions, total_clicks,
+        avg_ctr, avg_cpc, avg_roi, num_campaigns, total_records
+    ) = db.query(
+        func.coalesce(func.sum(ProcessedMetrics.spend), 0),
+        func.coalesce(func.sum(ProcessedMetrics.revenue), 0),
+        func.coalesce(func.sum(ProcessedMetrics.impressions), 0),
+        func.coalesce(func.sum(ProcessedMetrics.clicks), 0),
+        func.coalesce(func.avg(ProcessedMetrics.ctr), 0),
+        func.coalesce(func.avg(ProcessedMetrics.cpc), 0),
+        func.coalesce(func.avg(ProcessedMetrics.roi), 0),
+        func.count(func.distinct(ProcessedMetrics.campaign_name)),
+        func.count(ProcessedMetrics.id)
+    ).one()
     
     return {
         "total_spend": round(total_spend, 2),
         "total_revenue": round(total_revenue, 2),
         "total_impressions": total_impressions,
         "total_clicks": total_clicks,
-        "avg_ctr": round(sum(m.ctr for m in metrics) / len(metrics), 2),
-        "avg_cpc": round(sum(m.cpc for m in metrics) / len(metrics), 2),
-        "avg_roi": round(sum(m.roi for m in metrics) / len(metrics), 2),
-        "num_campaigns": len(set(m.campaign_name for m in metrics)),
-        "total_records": len(metrics)
+        "avg_ctr": round(avg_ctr, 2),
+        "avg_cpc": round(avg_cpc, 2),
+        "avg_roi": round(avg_roi, 2),
+        "num_campaigns": num_campaigns,
+        "total_records": total_records
     }
 
 
 @router.get("/campaigns")
-async def get_campaigns(db: Session = Depends(get_db)):
+def get_campaigns(request: Request, response: Response, db: Session = Depends(get_db)):
     """Get all unique campaigns"""
-    campaigns = db.query(ProcessedMetrics.campaign_name).distinct().all()
+    global _campaigns_cache
+    
+    _check_etag(request, response)
+    
+    with _CACHE_LOCK:
+        campaigns, version = _campaigns_cache, _DATA_VERSION
+    
+    if campaigns is None:
+        campaigns = [c[0] for c in db.query(ProcessedMetrics.campaign_name).distinct().all()]
+        with _CACHE_LOCK:
+            # Don't store a list read before an upload that landed meanwhile
+            if version == _DATA_VERSION:
+                _campaigns_cache = campaigns
+    
     return {
-        "campaigns": [c[0] for c in campaigns],
+        "campaigns": campaigns,
         "count": len(campaigns)
     }
 
 
 @router.get("/daily-performance")
-async def get_daily_performance(db: Session = Depends(get_db)):
+def get_daily_performance(request: Request, response: Response, db: Session = Depends(get_db)):
     """Get daily aggregated performance"""
-    metrics = db.query(ProcessedMetrics).order_by(ProcessedMetrics.date).all()
-    
-    daily_data = {}
-    for m in metrics:
-        date_key = str(m.date)
-        if date_key not in daily_data:
-            daily_data[date_key] = {
-                "date": date_key,
-                "spend": 0,
-                "revenue": 0,
-                "impressions": 0,
-                "clicks": 0,
-                "campaigns": 0
-            }
-        
-        daily_data[date_key]["spend"] += m.spend
-        daily_data[date_key]["revenue"] += m.revenue
-        daily_data[date_key]["impressions"] += m.impressions
-        daily_data[date_key]["clicks"] += m.clicks
-        daily_data[date_key]["campaigns"] = len(set(
-            m.campaign_name for m in db.query(ProcessedMetrics)
-            .filter(ProcessedMetrics.date == m.date).all()
-        ))
+    _check_etag(request, response)
+    return _daily_performance(db)
+
+
+@cached(_CACHE, key=_cache_key("daily_performance"), lock=_CACHE_LOCK)
+def _daily_performance(db: Session):
+    """Aggregate metrics per day (cached until the next upload)"""
+    rows = db.query(
+        ProcessedMetrics.date,
+        func.sum(ProcessedMetrics.spend),
+        func.sum(ProcessedMetrics.revenue),
+        func.sum(ProcessedMetrics.impressions),
+        func.sum(ProcessedMetrics.clicks),
+        func.count(func.distinct(ProcessedMetrics.campaign_name))
+    ).group_by(ProcessedMetrics.date).order_by(ProcessedMetrics.date).all()
     
-    # Calculate aggregated metrics
-    for date_key, data in daily_data.items():
-        data["ctr"] = round(
-            (data["clicks"] / data["impressions"] * 100) if data["impressions"] > 0 else 0, 2
-        )
-        data["cpc"] = round(
-            (data["spend"] / data["clicks"]) if data["clicks"] > 0 else 0, 2
-        )
-        data["roi"] = round(
-            ((data["revenue"] - data["spend"]) / data["spend"] * 100) if data["spend"] > 0 else 0, 2
-        )
+    daily_data = [
+        {
+            "date": str(day),
+            "spend": spend,
+            "revenue": revenue,
+            "impressions": impressions,
+            "clicks": clicks,
+            "campaigns": campaigns,
+            "ctr": round((clicks / impressions * 100) if impressions > 0 else 0, 2),
+            "cpc": round((spend / clicks) if clicks > 0 else 0, 2),
+            "roi": round(((revenue - spend) / spend * 100) if spend > 0 else 0, 2)
+        }
+        for day, spend, revenue, impressions, clicks, campaigns in rows
+    ]
     
     return {
-        "data": list(daily_data.values()),
+        "data": daily_data,
         "count": len(daily_data)
     }
 
 
 @router.get("/top-campaigns")
-async def get_top_campaigns(limit: int = Query(5), metric: str = Query("spend"), db: Session = Depends(get_db)):
+def get_top_campaigns(
+    request: Request,
+    response: Response,
+    limit: int = Query(5),
+    metric: str = Query("spend"),
+    db: Session = Depends(get_db)
+):
     """
     Get top campaigns by metric
     
@@ -201,59 +303,68 @@ async def get_top_campaigns(limit: int = Query(5), metric: str = Query("spend"),
     if metric not in valid_metrics:
         raise HTTPException(status_code=400, detail=f"Invalid metric. Must be one of: {valid_metrics}")
     
-    metrics = db.query(ProcessedMetrics).all()
+    _check_etag(request, response)
+    return _top_campaigns(db, limit=limit, metric=metric)
+
+
+@cached(_CACHE, key=_cache_key("top_campaigns"), lock=_CACHE_LOCK)
+def _top_campaigns(db: Session, limit: int, metric: str):
+    """Rank campaigns by their summed metric (cached per limit/metric until the next upload)"""
+    spend = func.sum(ProcessedMetrics.spend)
+    revenue = func.sum(ProcessedMetrics.revenue)
+    impressions = func.sum(ProcessedMetrics.impressions)
+    clicks = func.sum(ProcessedMetrics.clicks)
     
-    # Aggregate by campaign
-    campaign_data = {}
-    for m in metrics:
-        if m.campaign_name not in campaign_data:
-            campaign_data[m.campaign_name] = {
-                "campaign_name": m.campaign_name,
-                "spend": 0,
-                "revenue": 0,
-                "impressions": 0,
-                "clicks": 0,
-                "records": 0
-            }
-        
-        campaign_data[m.campaign_name]["spend"] += m.spend
-        campaign_data[m.campaign_name]["revenue"] += m.revenue
-        campaign_data[m.campaign_name]["impressions"] += m.impressions
-        campaign_data[m.campaign_name]["clicks"] += m.clicks
-        campaign_data[m.campaign_name]["records"] += 1
+    # Ratios are computed from the campaign totals (zero denominators rank as 0)
+    ctr = func.coalesce(clicks * 100.0 / func.nullif(impressions, 0), 0)
+    roi = func.coalesce((revenue - spend) * 100.0 / func.nullif(spend, 0), 0)
     
-    # Calculate avg metrics
-    for name, data in campaign_data.items():
-        data["ctr"] = round(
-            (data["clicks"] / data["impressions"] * 100) if data["impressions"] > 0 else 0, 2
-        )
-        data["roi"] = round(
-            ((data["revenue"] - data["spend"]) / data["spend"] * 100) if data["spend"] > 0 else 0, 2
-        )
+    order_by = {
+        "spend": spend,
+        "impressions": impressions,
+        "clicks": clicks,
+        "revenue": revenue,
+        "ctr": ctr,
+        "roi": roi
+    }[metric]
     
-    # Sort by requested metric
-    if metric in {"ctr", "roi"}:
-        sorted_campaigns = sorted(
-            campaign_data.values(),
-            key=lambda x: x[metric],
-            reverse=True
-        )
-    else:
-        sorted_campaigns = sorted(
-            campaign_data.values(),
-            key=lambda x: x[metric],
-            reverse=True
-        )
+    rows = db.query(
+        ProcessedMetrics.campaign_name,
+        spend,
+        revenue,
+        impressions,
+        clicks,
+        func.count(ProcessedMetrics.id),
+        ctr,
+        roi
+    ).group_by(ProcessedMetrics.campaign_name).order_by(
+        # Name breaks ties so equal totals rank the same on every request
+        order_by.desc(), ProcessedMetrics.campaign_name
+    ).limit(limit).all()
+    
+    num_campaigns = db.query(func.count(func.distinct(ProcessedMetrics.campaign_name))).scalar()
     
     return {
-        "data": sorted_campaigns[:limit],
-        "count": len(sorted_campaigns),
+        "data": [
+            {
+                "campaign_name": row[0],
+                "spend": row[1],
+                "revenue": row[2],
+                "impressions": row[3],
+                "clicks": row[4],
+                "records": row[5],
+                "ctr": round(row[6], 2),
+                "roi": round(row[7], 2)
+            }
+            for row in rows
+        ],
+        "count": num_campaigns,
         "metric": metric
     }
 
 
 @router.get("/upload-logs")
-async def get_upload_logs(limit: int = Query(20), db: Session = Depends(get_db)):
+def get_upload_logs(limit: int = Query(20), db: Session = Depends(get_db)):
     """Get recent upload logs"""
     logs = db.query(UploadLog).order_by(UploadLog.uploaded_at.desc()).limit(limit).all()
     
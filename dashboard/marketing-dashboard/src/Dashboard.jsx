@@ -18,6 +18,9 @@ import './Dashboard.css';
 
 const API_BASE = 'http://localhost:8000';
 
+// Revalidate with the API's ETag so fresh data shows right after an upload
+const FETCH_OPTIONS = { cache: 'no-cache' };
+
 const COLORS = ['#3b82f6', '#10b981', '#f59e0b', '#ef4444', '#8b5cf6', '#ec4899'];
 
 const Dashboard = () => {
@@ -40,9 +43,9 @@ const Dashboard = () => {
     try {
       setLoading(true);
       const [summaryRes, dailyRes, campaignsRes, logsRes] = await Promise.all([
-        fetch(`${API_BASE}/summary`),
-        fetch(`${API_BASE}/daily-performance`),
-        fetch(`${API_BASE}/top-campaigns?limit=5&metric=spend`),
+        fetch(`${API_BASE}/summary`, FETCH_OPTIONS),
+        fetch(`${API_BASE}/daily-performance`, FETCH_OPTIONS),
+        fetch(`${API_BASE}/top-campaigns?limit=5&metric=spend`, FETCH_OPTIONS),
         fetch(`${API_BASE}/upload-logs?limit=10`)
       ]);
 
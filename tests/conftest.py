@@ -0,0 +1,18 @@
+import io
+
+import pytest
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _warmup_pandas():
+    """Pay pandas' lazy first-call imports once, outside any single test's timing"""
+    try:
+        import numpy as np
+        import pandas as pd
+    except ImportError:
+        # test modules skip themselves via importorskip
+        return
+
+    pd.DataFrame({'x': [1.0, 2.0]}).groupby('x').sum()
+    pd.read_csv(io.StringIO('a,b\n1,2'))
+    np.zeros(1024).sum()
@@ -1,8 +1,56 @@
 import pytest
-import pandas as pd
+
+# Skip (rather than error) collection when the ETL's heavy deps are unavailable
+pd = pytest.importorskip("pandas")
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from app import etl, models
 from app.etl import MarketingETL
-import tempfile
-import os
+from app.models import Base, RawMarketingData, ProcessedMetrics, UploadLog
+import io
+import numpy as np
+
+# Expected column dtypes after clean_data
+_I64 = np.dtype(np.int64)
+_F64 = np.dtype(np.float64)
+
+# Built once at import with clean_data's target dtypes, so its copy-free path is exercised;
+# tests get deep copies since validate_csv and some tests modify the frame in place
+_VALID_DF = pd.DataFrame({
+    'date': ['2026-01-01', '2026-01-02'],
+    'campaign_name': ['Google Search', 'Meta Ads'],
+    'impressions': [5000, 3000],
+    'clicks': [150, 90],
+    'spend': [500.0, 300.0],
+    'revenue': [2500.0, 1800.0]
+}).astype(MarketingETL.CLEAN_DTYPES)
+
+# Ground-truth metrics for the first _VALID_DF row (150/5000 clicks, 500 spend, 2500 revenue)
+_EXPECTED_CTR_ROW0 = 3.0
+_EXPECTED_CPC_ROW0 = 3.33
+_EXPECTED_ROI_ROW0 = 400.0
+
+# Header of a well-formed upload, for the read_csv file tests
+_CSV_HEADER = "date,campaign_name,impressions,clicks,spend,revenue"
+
+# Row-threshold attribute that switches each size-gated metrics backend on
+_MIN_ROWS_ATTR = {"numba": "JIT_MIN_ROWS", "numexpr": "NUMEXPR_MIN_ROWS"}
+
+# Pre-typed one-row frame that the validate_csv failure cases override column by column
+_TEMPLATE = pd.DataFrame({
+    'date': pd.Series(['2026-01-01'], dtype='string'),
+    'campaign_name': pd.Series(['Google'], dtype='string'),
+    'impressions': np.array([100], dtype=np.int64),
+    'clicks': np.array([10], dtype=np.int64),
+    'spend': np.array([50.0], dtype=np.float64)
+})
+
+
+def _mk(**over):
+    """Return a copy of _TEMPLATE with the given columns replaced"""
+    return _TEMPLATE.assign(**over)
 
 
 class TestMarketingETL:
@@ -10,73 +58,139 @@ class TestMarketingETL:
     
     @pytest.fixture
     def valid_df(self):
-        """Create valid test dataframe"""
+        """Create valid test dataframe (deep copy of the prebuilt frame)"""
+        return _VALID_DF.copy()
+    
+    @pytest.fixture
+    def random_df(self):
+        """Random metric inputs with zero divisors and sub-1 spend, large enough for the JIT path"""
+        rng = np.random.default_rng(0)
+        n = MarketingETL.JIT_MIN_ROWS
         return pd.DataFrame({
-            'date': ['2026-01-01', '2026-01-02'],
-            'campaign_name': ['Google Search', 'Meta Ads'],
-            'impressions': [5000, 3000],
-            'clicks': [150, 90],
-            'spend': [500.0, 300.0],
-            'revenue': [2500.0, 1800.0]
+            'impressions': rng.integers(0, 10000, n),
+            'clicks': rng.integers(0, 300, n),
+            'spend': rng.choice([0.0, 0.5, 1.5, 33.3, 517.25], n),
+            'revenue': rng.random(n) * 5000
         })
     
+    @pytest.fixture
+    def db(self):
+        """Session on a fresh in-memory database"""
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+        yield session
+        session.close()
+    
     def test_validate_csv_valid(self, valid_df):
         """Test validation passes for valid data"""
         is_valid, msg = MarketingETL.validate_csv(valid_df)
         assert is_valid is True
         assert msg == "Validation passed"
     
-    def test_validate_csv_missing_columns(self):
-        """Test validation fails for missing columns"""
-        df = pd.DataFrame({'date': ['2026-01-01']})
-        is_valid, msg = MarketingETL.validate_csv(df)
+    @pytest.mark.parametrize("df_factory,substring", [
+        (lambda: _mk()[['date']], "Missing columns"),
+        (lambda: _mk(clicks=np.array([200], dtype=np.int64)), "Clicks cannot exceed impressions"),
+        (lambda: _mk(impressions=np.array([-100], dtype=np.int64)), "Negative values not allowed"),
+        (lambda: pd.DataFrame(), "empty"),
+        (lambda: _mk(campaign_name=pd.Series([pd.NA], dtype='string')), "Campaign name cannot be empty"),
+        (lambda: _mk(campaign_name=['  ']), "Campaign name cannot be empty"),
+    ], ids=[
+        "missing_columns", "clicks_exceed_impressions", "negative_values", "empty",
+        "missing_name", "blank_name"
+    ])
+    def test_validate_csv_invalid(self, df_factory, substring):
+        """Test validation fails with a descriptive message for invalid data"""
+        is_valid, msg = MarketingETL.validate_csv(df_factory())
         assert is_valid is False
-        assert "Missing columns" in msg
+        assert substring.lower() in msg.lower()
     
-    def test_validate_csv_clicks_exceed_impressions(self):
-        """Test validation fails when clicks > impressions"""
-        df = pd.DataFrame({
-            'date': ['2026-01-01'],
-            'campaign_name': ['Google'],
-            'impressions': [100],
-            'clicks': [200],  # Invalid
-            'spend': [50.0]
-        })
-        is_valid, msg = MarketingETL.validate_csv(df)
-        assert is_valid is False
-        assert "Clicks cannot exceed impressions" in msg
+    def test_read_csv_typed(self, tmp_path):
+        """Test a well-formed file is read with the typed dtypes, dropping extra columns"""
+        path = tmp_path / "in.csv"
+        path.write_text(_CSV_HEADER + ",notes\n2026-01-01,Google,100,10,50.0,250.0,x\n")
+        df = MarketingETL.read_csv(path)
+        
+        assert list(df.columns) == _CSV_HEADER.split(",")
+        assert pd.api.types.is_datetime64_any_dtype(df['date'])
+        assert df['clicks'].dtype == _I64
+        assert df['revenue'].dtype == _F64
     
-    def test_validate_csv_negative_values(self):
-        """Test validation fails for negative values"""
-        df = pd.DataFrame({
-            'date': ['2026-01-01'],
-            'campaign_name': ['Google'],
-            'impressions': [-100],  # Invalid
-            'clicks': [10],
-            'spend': [50.0]
-        })
-        is_valid, msg = MarketingETL.validate_csv(df)
-        assert is_valid is False
-        assert "Negative values not allowed" in msg
+    def test_read_csv_without_revenue(self, tmp_path):
+        """Test revenue is optional on the typed path and defaulted by clean_data"""
+        path = tmp_path / "in.csv"
+        path.write_text("date,campaign_name,impressions,clicks,spend\n2026-01-01,Google,100,10,50.0\n")
+        df = MarketingETL.read_csv(path)
+        
+        assert 'revenue' not in df
+        assert MarketingETL.validate_csv(df) == (True, "Validation passed")
+        assert MarketingETL.clean_data(df)['revenue'].tolist() == [0.0]
+    
+    def test_read_csv_falls_back_on_blank_int(self, tmp_path):
+        """Test a blank in an int column falls back to an inferred read that keeps every row"""
+        path = tmp_path / "in.csv"
+        path.write_text(
+            _CSV_HEADER + "\n"
+            "2026-01-01,Google,100,,50.0,250.0\n"
+            "2026-01-02,Google,100,10,50.0,250.0\n"
+        )
+        df = MarketingETL.read_csv(path)
+        
+        assert len(df) == 2
+        assert df['clicks'].isna().tolist() == [True, False]
+        assert MarketingETL.validate_csv(df)[0] is True
+        assert MarketingETL.clean_data(df)['clicks'].tolist() == [0, 10]
     
-    def test_validate_csv_empty(self):
-        """Test validation fails for empty dataframe"""
-        df = pd.DataFrame()
-        is_valid, msg = MarketingETL.validate_csv(df)
+    def test_read_csv_missing_column(self, tmp_path):
+        """Test a file without a required column is read and then rejected by validate_csv"""
+        path = tmp_path / "in.csv"
+        path.write_text("date,campaign_name,impressions,spend\n2026-01-01,Google,100,50.0\n")
+        
+        is_valid, msg = MarketingETL.validate_csv(MarketingETL.read_csv(path))
         assert is_valid is False
-        assert "empty" in msg.lower()
+        assert "clicks" in msg
+    
+    def test_read_csv_blank_campaign_name(self, tmp_path):
+        """Test a blank campaign name is rejected instead of stored as a sentinel string"""
+        path = tmp_path / "in.csv"
+        path.write_text(_CSV_HEADER + "\n2026-01-01,,100,10,50.0,250.0\n")
+        
+        assert MarketingETL.validate_csv(MarketingETL.read_csv(path)) == (
+            False, "Campaign name cannot be empty"
+        )
     
     def test_clean_data(self, valid_df):
         """Test data cleaning"""
         cleaned = MarketingETL.clean_data(valid_df)
         
         # Check no duplicates
-        assert len(cleaned) == len(cleaned.drop_duplicates())
+        assert not cleaned.duplicated().any()
         
         # Check data types
-        assert cleaned['clicks'].dtype in [int, 'int64']
-        assert cleaned['impressions'].dtype in [int, 'int64']
-        assert cleaned['spend'].dtype == float
+        assert cleaned['clicks'].dtype == _I64
+        assert cleaned['impressions'].dtype == _I64
+        assert cleaned['spend'].dtype == _F64
+    
+    def test_clean_data_defaults_missing_revenue(self, valid_df):
+        """Test a file without revenue gets a zero-filled float64 column"""
+        cleaned = MarketingETL.clean_data(valid_df.drop(columns='revenue'))
+        
+        assert cleaned['revenue'].dtype == _F64
+        assert cleaned['revenue'].tolist() == [0.0, 0.0]
+    
+    @pytest.mark.parametrize("clicks", [
+        pd.Series([150.0, np.nan]),
+        pd.Series([150, None], dtype=object),
+    ], ids=["nan_float", "object"])
+    def test_clean_data_fills_and_casts(self, valid_df, clicks):
+        """Test untyped or NaN-holding columns are zero-filled and cast to int64/float64"""
+        df = valid_df.assign(clicks=clicks, spend=[500.0, np.nan])
+        cleaned = MarketingETL.clean_data(df)
+        
+        assert cleaned['clicks'].dtype == _I64
+        assert cleaned['clicks'].tolist() == [150, 0]
+        assert cleaned['spend'].dtype == _F64
+        assert cleaned['spend'].tolist() == [500.0, 0.0]
     
     def test_calculate_metrics(self, valid_df):
         """Test metric calculation"""
@@ -84,17 +198,15 @@ class TestMarketingETL:
         metrics = MarketingETL.calculate_metrics(df)
         
         # Check CTR calculation
-        expected_ctr = (150 / 5000) * 100
-        assert metrics.iloc[0]['ctr'] == round(expected_ctr, 2)
+        assert metrics['ctr'].iat[0] == _EXPECTED_CTR_ROW0
         
         # Check CPC calculation
-        expected_cpc = 500.0 / 150
-        assert metrics.iloc[0]['cpc'] == round(expected_cpc, 2)
+        assert metrics['cpc'].iat[0] == _EXPECTED_CPC_ROW0
         
         # Check ROI calculation
-        expected_roi = ((2500.0 - 500.0) / 500.0) * 100
-        assert metrics.iloc[0]['roi'] == round(expected_roi, 2)
+        assert metrics['roi'].iat[0] == _EXPECTED_ROI_ROW0
     
+    @pytest.mark.filterwarnings("error::RuntimeWarning")
     def test_calculate_metrics_zero_division(self):
         """Test metrics handle zero division gracefully"""
         df = pd.DataFrame({
@@ -109,68 +221,135 @@ class TestMarketingETL:
         metrics = MarketingETL.calculate_metrics(df)
         
         # Should not raise exception and return 0
-        assert metrics.iloc[0]['ctr'] == 0
-        assert metrics.iloc[0]['cpc'] == 0
-        assert metrics.iloc[0]['roi'] == 0
+        assert metrics['ctr'].iat[0] == 0
+        assert metrics['cpc'].iat[0] == 0
+        assert metrics['roi'].iat[0] == 0
     
-    def test_process_csv_creates_csv(self, valid_df):
-        """Test CSV processing saves to temporary file"""
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp:
-            valid_df.to_csv(tmp.name, index=False)
-            temp_path = tmp.name
+    @pytest.mark.parametrize("backend", ["numba", "numexpr", "polars"])
+    def test_calculate_metrics_backend_matches_numpy(self, random_df, monkeypatch, backend):
+        """Test each optional metrics backend gives the same metrics as the numpy path"""
+        pytest.importorskip(backend)
+        n = len(random_df)
         
-        try:
-            # Just verify it reads without error
-            test_df = pd.read_csv(temp_path)
-            assert len(test_df) == 2
-        finally:
-            os.unlink(temp_path)
-
-
-class TestMarketingMetrics:
-    """Test metric calculations"""
+        # Reference run with every accelerated path switched off
+        monkeypatch.setattr(MarketingETL, "JIT_MIN_ROWS", n + 1)
+        monkeypatch.setattr(MarketingETL, "NUMEXPR_MIN_ROWS", n + 1)
+        monkeypatch.setenv("POLARS_ETL", "0")
+        assert etl._load_polars() is None
+        expected = MarketingETL.calculate_metrics(random_df)
+        
+        if backend == "polars":
+            monkeypatch.setenv("POLARS_ETL", "1")
+            assert etl._load_polars() is not None
+        else:
+            monkeypatch.setattr(MarketingETL, _MIN_ROWS_ATTR[backend], n)
+        
+        pd.testing.assert_frame_equal(MarketingETL.calculate_metrics(random_df), expected)
     
-    def test_ctr_calculation(self):
-        """Test CTR = clicks / impressions * 100"""
-        df = pd.DataFrame({
-            'impressions': [1000, 2000],
-            'clicks': [50, 100],
-            'spend': [100, 200],
-            'revenue': [500, 1000]
-        })
+    def test_load_to_database(self, valid_df, db):
+        """Test cleaned metrics are bulk inserted alongside an upload log"""
+        df = MarketingETL.calculate_metrics(MarketingETL.clean_data(valid_df))
+        result = MarketingETL.load_to_database(df, db, "test.csv")
         
-        ctr = MarketingETL.calculate_metrics(df)['ctr'].tolist()
+        assert result == (2, 0, "success")
+        assert db.query(RawMarketingData).count() == 2
+        assert db.query(ProcessedMetrics).count() == 2
+        assert db.query(UploadLog).one().rows_uploaded == 2
+    
+    def test_load_to_database_after_session_use(self, valid_df, db):
+        """Test loading works on a session that already autobegan a transaction"""
+        assert db.query(UploadLog).count() == 0
+        
+        df = MarketingETL.calculate_metrics(MarketingETL.clean_data(valid_df))
+        result = MarketingETL.load_to_database(df, db, "test.csv")
         
-        assert ctr[0] == 5.0  # 50/1000 * 100
-        assert ctr[1] == 5.0  # 100/2000 * 100
+        assert result == (2, 0, "success")
+        assert db.query(ProcessedMetrics).count() == 2
     
-    def test_cpc_calculation(self):
-        """Test CPC = spend / clicks"""
-        df = pd.DataFrame({
-            'impressions': [1000, 2000],
-            'clicks': [50, 100],
-            'spend': [100.0, 200.0],
-            'revenue': [500, 1000]
-        })
+    def test_load_to_database_skips_duplicates(self, valid_df, db):
+        """Test re-uploading the same rows does not duplicate processed metrics"""
+        df = MarketingETL.calculate_metrics(MarketingETL.clean_data(valid_df))
+        MarketingETL.load_to_database(df, db, "test.csv")
+        result = MarketingETL.load_to_database(df, db, "test.csv")
         
-        cpc = MarketingETL.calculate_metrics(df)['cpc'].tolist()
+        assert result == (0, 2, "partial")
+        assert db.query(RawMarketingData).count() == 4
+        assert db.query(ProcessedMetrics).count() == 2
+        log = db.query(UploadLog).order_by(UploadLog.id.desc()).first()
+        assert (log.rows_uploaded, log.status) == (0, "partial")
+    
+    def test_load_to_database_reports_in_file_duplicates(self, valid_df, db):
+        """Test rows sharing a key within one file are counted as skipped"""
+        valid_df['campaign_name'] = ['Google ', 'google']
+        valid_df['date'] = ['2026-01-01', '2026-01-01']
+        df = MarketingETL.calculate_metrics(MarketingETL.clean_data(valid_df))
+        result = MarketingETL.load_to_database(df, db, "test.csv")
         
-        assert cpc[0] == round(100.0 / 50, 2)  # 2.0
-        assert cpc[1] == round(200.0 / 100, 2)  # 2.0
+        assert result == (1, 1, "partial")
+        assert db.query(ProcessedMetrics).count() == 1
+        log = db.query(UploadLog).one()
+        assert log.rows_uploaded == 1
+        assert "Skipped 1" in log.error_message
     
-    def test_roi_calculation(self):
-        """Test ROI = (revenue - spend) / spend * 100"""
-        df = pd.DataFrame({
-            'impressions': [1000],
-            'clicks': [50],
-            'spend': [100.0],
-            'revenue': [500.0]
-        })
+    def test_init_db_refuses_to_drop_duplicate_metrics(self, tmp_path, monkeypatch):
+        """Test init_db keeps duplicate rows until an explicit dedupe, then migrates the indexes"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+        monkeypatch.setattr(models, "engine", engine)
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            # Schema from before the unique index, holding three rows for one key
+            conn.execute(text("DROP INDEX uq_pm_campaign_date"))
+            conn.execute(text("CREATE INDEX ix_processed_metrics_date ON processed_metrics (date)"))
+            conn.execute(text(
+                "INSERT INTO processed_metrics (campaign_name, date) VALUES "
+                "('google', '2026-01-01'), ('google', '2026-01-01'), ('google', '2026-01-01')"
+            ))
         
-        roi = MarketingETL.calculate_metrics(df)['roi'].iloc[0]
-        expected = ((500 - 100) / 100) * 100  # 400%
+        with pytest.raises(RuntimeError, match="--dedupe"):
+            models.init_db()
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT COUNT(*) FROM processed_metrics")).scalar() == 3
+        
+        assert models.dedupe_processed_metrics() == 2
+        models.init_db()
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT COUNT(*) FROM processed_metrics")).scalar() == 1
+        indexes = {ix["name"] for ix in inspect(engine).get_indexes("processed_metrics")}
+        assert indexes == {"ix_processed_metrics_id", "ix_pm_date_campaign", "uq_pm_campaign_date"}
+    
+    def test_process_csv_creates_csv(self, valid_df):
+        """Test CSV round-trips through an in-memory buffer"""
+        buf = io.StringIO()
+        valid_df.to_csv(buf, index=False)
         
-        assert roi == round(expected, 2)
+        # Header plus one line per row; only the header is parsed back
+        assert buf.getvalue().count('\n') - 1 == 2
+        buf.seek(0)
+        assert list(pd.read_csv(buf, nrows=0).columns) == list(valid_df.columns)
+
+
+@pytest.fixture(scope="module")
+def metrics():
+    """Calculate metrics once for all metric tests"""
+    return MarketingETL.calculate_metrics(pd.DataFrame({
+        'impressions': [1000, 2000],
+        'clicks': [50, 100],
+        'spend': [100.0, 200.0],
+        'revenue': [500.0, 1000.0]
+    }))
+
+
+class TestMarketingMetrics:
+    """Test metric calculations"""
+    
+    @pytest.mark.parametrize("col,expected", [
+        ("ctr", [5.0, 5.0]),        # CTR = clicks / impressions * 100
+        ("cpc", [2.0, 2.0]),        # CPC = spend / clicks
+        ("roi", [400.0, 400.0]),    # ROI = (revenue - spend) / spend * 100
+    ])
+    def test_metric_calculation(self, metrics, col, expected):
+        """Test each metric column against hand-computed values"""
+        assert metrics[col].tolist() == expected
 
 
 if __name__ == '__main__':
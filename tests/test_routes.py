@@ -0,0 +1,103 @@
+import pytest
+
+# Skip (rather than error) collection when the API's deps are unavailable
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import routes
+from app.models import Base, get_db
+
+_CSV = (
+    b"date,campaign_name,impressions,clicks,spend,revenue\n"
+    b"2026-01-01,Google Search,5000,150,500,2500\n"
+    b"2026-01-01,Meta Ads,3000,90,300,1800\n"
+)
+
+
+@pytest.fixture
+def client(tmp_path):
+    """API client on a fresh file database, with the read caches emptied"""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'api.db'}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[get_db] = override_get_db
+
+    with routes._CACHE_LOCK:
+        routes._CACHE.clear()
+        routes._campaigns_cache = None
+    yield TestClient(app)
+    engine.dispose()
+
+
+class TestConditionalGets:
+    """ETag / 304 handling and invalidation of the cached read endpoints"""
+
+    def test_etag_revalidation_and_upload_invalidation(self, client):
+        """Test 304 on a matching ETag, then a new ETag and fresh body after an upload"""
+        r = client.get("/summary")
+        assert r.status_code == 200
+        assert r.json()["total_records"] == 0
+        etag = r.headers["etag"]
+        assert r.headers["cache-control"] == routes.CACHE_CONTROL
+        assert client.get("/campaigns").json()["count"] == 0
+
+        for path in ("/summary", "/campaigns", "/daily-performance", "/top-campaigns"):
+            r = client.get(path, headers={"If-None-Match": etag})
+            assert r.status_code == 304
+            assert r.headers["etag"] == etag
+
+        r = client.post("/upload-csv", files={"file": ("ads.csv", _CSV, "text/csv")})
+        assert r.status_code == 200
+        assert r.json()["rows_loaded"] == 2
+
+        r = client.get("/summary", headers={"If-None-Match": etag})
+        assert r.status_code == 200
+        assert r.headers["etag"] != etag
+        assert r.json()["total_records"] == 2
+
+        r = client.get("/campaigns", headers={"If-None-Match": etag})
+        assert r.status_code == 200
+        assert r.json()["campaigns"] == ["google search", "meta ads"]
+
+    def test_invalid_params_are_rejected_before_etag_match(self, client):
+        """Test a current ETag doesn't turn a bad request into 304"""
+        etag = client.get("/summary").headers["etag"]
+
+        r = client.get("/top-campaigns?metric=bogus", headers={"If-None-Match": etag})
+        assert r.status_code == 400
+
+        r = client.get("/top-campaigns?limit=abc", headers={"If-None-Match": etag})
+        assert r.status_code == 422
+
+
+class TestTopCampaigns:
+    """Ranking of /top-campaigns"""
+
+    def test_ties_are_ordered_by_name(self, client):
+        """Test campaigns with equal totals come back in a stable, name-sorted order"""
+        csv = (
+            b"date,campaign_name,impressions,clicks,spend,revenue\n"
+            b"2026-01-01,Zeta,1000,10,100,200\n"
+            b"2026-01-01,Alpha,1000,10,100,200\n"
+            b"2026-01-01,Mid,1000,10,300,200\n"
+        )
+        client.post("/upload-csv", files={"file": ("ads.csv", csv, "text/csv")})
+
+        r = client.get("/top-campaigns?metric=spend")
+        assert [row["campaign_name"] for row in r.json()["data"]] == ["mid", "alpha", "zeta"]